@@ -1,7 +1,8 @@
 """
 Sample mixer and sequencer meant to create rhythms. Inspired by the Roland TR-909.
-Uses PyAudio (https://pypi.python.org/pypi/PyAudio) for playing sound. On windows
-it can fall back to using the winsound module if pysound isn't available.
+Uses sounddevice (https://pypi.python.org/pypi/sounddevice) for playing sound, or
+PyAudio (https://pypi.python.org/pypi/PyAudio) if sounddevice isn't installed. On windows
+it can fall back to using the winsound module if neither of them is available.
 
 Sample mix rate is configured at 44.1 khz. You may want to change this if most of
 the samples you're using are of a different sample rate (such as 48Khz), to avoid
@@ -11,23 +12,39 @@ Written by Irmen de Jong (irmen@razorvine.net) - License: MIT open-source.
 """
 
 import sys
-import os
+import io
 import wave
+import mmap
+import struct
 import audioop
 import array
 import threading
-import queue
+import weakref
+import atexit
 import math
 import itertools
 try:
-    import pyaudio
-except ImportError:
+    import sounddevice
     pyaudio = None
-    import winsound
+except (ImportError, OSError):   # OSError: the package is installed, but the PortAudio library is missing
+    sounddevice = None
+    try:
+        import pyaudio
+    except ImportError:
+        pyaudio = None
+        import winsound
 try:
     import numpy
 except ImportError:
     numpy = None
+try:
+    import numba
+except ImportError:
+    numba = None
+try:
+    import soxr
+except ImportError:
+    soxr = None
 
 
 __all__ = ["Sample", "Output", "LevelMeter"]
@@ -43,6 +60,205 @@ samplewidths_to_arraycode = {
 if array.array('i').itemsize == 4:
     samplewidths_to_arraycode[4] = 'i'
 
+# sample data is always little endian, arrays with native values need byteswapping on big endian machines
+native_little_endian = sys.byteorder == "little"
+
+# numpy has no 24 bits integer type, so 3-byte samples always use the slower code paths
+samplewidths_to_numpy_dtype = {
+    2: '<i2',
+    4: '<i4'
+}
+
+# the wav file chunk header and the PCM format chunk, for parsing memory mapped wav files
+wav_chunk_header = struct.Struct("<4sI")
+wav_format_chunk = struct.Struct("<HHIIHH")
+
+if pyaudio:
+    samplewidths_to_pyaudio_format = {
+        2: pyaudio.paInt16,
+        3: pyaudio.paInt24,
+        4: pyaudio.paInt32
+    }
+
+
+if numba:
+    # Optional compiled kernels for the sample loops that numpy can only do via temporary float arrays.
+    # The input arrays are numpy views directly on the frame bytes, the output arrays are freshly allocated.
+    # They are compiled lazily on their first use (for each sample width), so importing stays fast.
+    # The compiled code is not cached on disk, because numba ties the cache to the module's import name.
+    # The kernels release the GIL so other threads can run while they process the samples.
+    # They are not parallelized: the sample fragments are small, and the parallel kernels abort the
+    # process when they're called from several threads with numba's default (workqueue) threading layer.
+    # No fastmath: the factors can be non-finite, and the results must stay the same as without numba.
+    _kernel_options = dict(nogil=True)
+
+    @numba.njit(**_kernel_options)
+    def _fade_kernel(samples, start_amp, end_amp, maxvalue, out):
+        """Linear volume ramp over the frames (rows) of the samples, saturating at the sample range."""
+        numframes = samples.shape[0]
+        increase = end_amp-start_amp
+        for i in range(numframes):
+            amplitude = start_amp+i*increase/numframes
+            for c in range(samples.shape[1]):
+                value = samples[i, c]*amplitude
+                if value > maxvalue-1:
+                    value = maxvalue-1
+                elif value < -maxvalue:
+                    value = -maxvalue
+                out[i, c] = int(value)
+
+    @numba.njit(**_kernel_options)
+    def _modulate_kernel(samples, factors, maxvalue, out):
+        """Multiply every sample by its own factor, saturating at the sample range."""
+        for i in range(samples.shape[0]):
+            value = samples[i]*factors[i]
+            if value > maxvalue-1:
+                value = maxvalue-1
+            elif value < -maxvalue:
+                value = -maxvalue
+            out[i] = int(value)
+
+    @numba.njit(**_kernel_options)
+    def _pan_kernel(samples, panning, out):
+        """Pan the frames (rows) of the samples into the stereo output frames, with a panning value per frame."""
+        last = samples.shape[1]-1   # for mono samples, this is the same column as the first one
+        for i in range(samples.shape[0]):
+            out[i, 0] = int(samples[i, 0]*(1-panning[i])/2)
+            out[i, 1] = int(samples[i, last]*(1+panning[i])/2)
+
+    @numba.njit(**_kernel_options)
+    def _mul_kernel(samples, factor, maxvalue, out):
+        """Multiply every sample by the factor, saturating at the sample range (like audioop.mul)."""
+        for i in range(samples.shape[0]):
+            value = samples[i]*factor
+            if value > maxvalue-1:
+                value = maxvalue-1
+            elif value < -maxvalue:
+                value = -maxvalue
+            out[i] = int(numpy.floor(value))
+
+    @numba.njit(**_kernel_options)
+    def _add_kernel(samples1, samples2, maxvalue, out):
+        """Add the samples together, saturating at the sample range (like audioop.add)."""
+        for i in range(samples1.shape[0]):
+            value = numba.int64(samples1[i])+samples2[i]
+            out[i] = min(max(value, -maxvalue), maxvalue-1)
+
+    @numba.njit(**_kernel_options)
+    def _mix_kernel(target, samples, maxvalue):
+        """Add the samples into the target samples in place, saturating at the sample range (like audioop.add)."""
+        for i in range(target.shape[0]):
+            value = numba.int64(target[i])+samples[i]
+            target[i] = min(max(value, -maxvalue), maxvalue-1)
+
+    @numba.njit(**_kernel_options)
+    def _bias_kernel(samples, bias, out):
+        """Add the bias to every sample, wrapping around on overflow (like audioop.bias)."""
+        for i in range(samples.shape[0]):
+            out[i] = samples[i]+bias
+
+
+def _mul_frames_numba(frames, samplewidth, factor):
+    samples = numpy.frombuffer(frames, dtype=samplewidths_to_numpy_dtype[samplewidth])
+    result = numpy.empty_like(samples)
+    _mul_kernel(samples, float(factor), 2**(8*samplewidth-1), result)
+    return result.tobytes()
+
+
+def _add_frames_numba(frames1, frames2, samplewidth):
+    if len(frames1) != len(frames2):
+        return audioop.add(frames1, frames2, samplewidth)   # raises the appropriate error
+    dtype = samplewidths_to_numpy_dtype[samplewidth]
+    samples1 = numpy.frombuffer(frames1, dtype=dtype)
+    samples2 = numpy.frombuffer(frames2, dtype=dtype)
+    result = numpy.empty_like(samples1)
+    _add_kernel(samples1, samples2, 2**(8*samplewidth-1), result)
+    return result.tobytes()
+
+
+def _add_frames_numpy(frames1, frames2, samplewidth):
+    if len(frames1) != len(frames2):
+        return audioop.add(frames1, frames2, samplewidth)   # raises the appropriate error
+    dtype = samplewidths_to_numpy_dtype[samplewidth]
+    samples1 = numpy.frombuffer(frames1, dtype=dtype)
+    samples2 = numpy.frombuffer(frames2, dtype=dtype)
+    maxvalue = 2**(8*samplewidth-1)
+    # add in a wider integer type and saturate with clip, which numpy vectorizes without branches
+    result = numpy.add(samples1, samples2, dtype=numpy.int32 if samplewidth == 2 else numpy.int64)
+    return numpy.clip(result, -maxvalue, maxvalue-1, out=result).astype(dtype).tobytes()
+
+
+def _add_into_frames_numba(target, frames, samplewidth):
+    dtype = samplewidths_to_numpy_dtype[samplewidth]
+    _mix_kernel(numpy.frombuffer(target, dtype=dtype), numpy.frombuffer(frames, dtype=dtype), 2**(8*samplewidth-1))
+
+
+def _add_into_frames_numpy(target, frames, samplewidth):
+    dtype = samplewidths_to_numpy_dtype[samplewidth]
+    result = numpy.frombuffer(target, dtype=dtype)
+    samples2 = numpy.frombuffer(frames, dtype=dtype)
+    maxvalue = 2**(8*samplewidth-1)
+    mixed = numpy.add(result, samples2, dtype=numpy.int32 if samplewidth == 2 else numpy.int64)
+    result[:] = numpy.clip(mixed, -maxvalue, maxvalue-1, out=mixed)
+
+
+def _add_into_frames_audioop(target, frames, samplewidth):
+    target[:] = audioop.add(target, frames, samplewidth)
+
+
+def _bias_frames_numba(frames, samplewidth, bias):
+    samples = numpy.frombuffer(frames, dtype=samplewidths_to_numpy_dtype[samplewidth])
+    result = numpy.empty_like(samples)
+    _bias_kernel(samples, int(bias), result)
+    return result.tobytes()
+
+
+# The implementations of the basic sample operations, specialized per sample width.
+# They're selected once here so the sample methods don't have to check what's available on every call.
+# All of them take the same arguments as (and are bit-exact with) the audioop function they replace.
+# _add_into_frames is the in-place variant of audioop.add:
+# it adds the frames to the (same sized) writable target buffer.
+_mul_frames = {}
+_add_frames = {}
+_add_into_frames = {}
+_bias_frames = {}
+for _width in (2, 3, 4):
+    if numba and _width in samplewidths_to_numpy_dtype:
+        _mul_frames[_width] = _mul_frames_numba
+        _add_frames[_width] = _add_frames_numba
+        _add_into_frames[_width] = _add_into_frames_numba
+        _bias_frames[_width] = _bias_frames_numba
+    elif numpy and _width in samplewidths_to_numpy_dtype:
+        _mul_frames[_width] = audioop.mul
+        _add_frames[_width] = _add_frames_numpy
+        _add_into_frames[_width] = _add_into_frames_numpy
+        _bias_frames[_width] = audioop.bias
+    else:
+        _mul_frames[_width] = audioop.mul
+        _add_frames[_width] = audioop.add
+        _add_into_frames[_width] = _add_into_frames_audioop
+        _bias_frames[_width] = audioop.bias
+del _width
+
+
+def _levels_from_buffer(frames, samplewidth, nchannels, rms_mode=False):
+    """
+    Returns the (left, right) peak or rms levels of the interleaved frames, as absolute sample values.
+    Every channel is reduced on its own (strided) column of the interleaved frames, no channel copies needed;
+    that is much faster than a reduction along an axis of the frames array.
+    """
+    samples = numpy.frombuffer(frames, dtype=samplewidths_to_numpy_dtype[samplewidth]).reshape(-1, nchannels)
+    levels = []
+    for channel in range(nchannels):
+        column = samples[:, channel]
+        if rms_mode:
+            column = column.astype(numpy.float64)
+            levels.append(int(math.sqrt(column @ column / len(column))))
+        else:
+            # max and -min instead of abs, because abs overflows on the most negative sample value
+            levels.append(max(int(column.max()), -int(column.min())))
+    return levels[0], levels[-1]
+
 
 class Sample:
     """
@@ -68,9 +284,24 @@ class Sample:
             self.__samplerate = self.norm_samplerate
             self.__nchannels = self.norm_nchannels
             self.__samplewidth = self.norm_samplewidth
+            # the frames can be any bytes-like object (bytes, bytearray, memoryview)
+            # but they are never modified in place, so copies of the sample can share them.
+            # The only exception is the owned buffer (see _owned_frames) that no-one else references.
             self.__frames = b""
             self.__filename = None
 
+    @property
+    def __frames(self):
+        return self.__frame_data
+
+    @__frames.setter
+    def __frames(self, frames):
+        # a newly assigned frames object is never owned (see _owned_frames), even if it's a bytearray
+        self.__frame_data = frames
+        self.__frames_owned = False
+        # the remembered maximum and rms values are for the previous frames
+        self.__cached_max = self.__cached_rms = None
+
     def __repr__(self):
         locked = " (locked)" if self.__locked else ""
         return "<Sample at 0x{0:x}, {1:g} seconds, {2:d} channels, {3:d} bits, rate {4:d}{5:s}>"\
@@ -116,8 +347,12 @@ class Sample:
                     raise TypeError("the sample values must be integer")
         samplewidth = array_or_list.itemsize
         assert 2 <= samplewidth <= 4
+        if numpy and isinstance(array_or_list, numpy.ndarray) and samplewidth in samplewidths_to_numpy_dtype:
+            # the little endian dtype takes care of the byte order, no byteswap needed
+            frames = array_or_list.astype(samplewidths_to_numpy_dtype[samplewidth], copy=False).tobytes()
+            return Sample.from_raw_frames(frames, samplewidth, samplerate, numchannels)
         frames = array_or_list.tobytes()
-        if sys.byteorder == "big":
+        if not native_little_endian:
             frames = audioop.byteswap(frames, samplewidth)
         return Sample.from_raw_frames(frames, samplewidth, samplerate, numchannels)
 
@@ -147,11 +382,17 @@ class Sample:
 
     @property
     def maximum(self):
-        return audioop.max(self.__frames, self.samplewidth)
+        """The maximum absolute sample value. It is remembered until the sample data changes."""
+        if self.__cached_max is None:
+            self.__cached_max = audioop.max(self.__frames, self.__samplewidth)
+        return self.__cached_max
 
     @property
     def rms(self):
-        return audioop.rms(self.__frames, self.samplewidth)
+        """The root-mean-square of the sample values. It is remembered until the sample data changes."""
+        if self.__cached_rms is None:
+            self.__cached_rms = audioop.rms(self.__frames, self.__samplewidth)
+        return self.__cached_rms
 
     @property
     def level_db_peak(self):
@@ -170,14 +411,17 @@ class Sample:
         so the db levels could be used to show a level meter for the duration of the sample.
         """
         maxvalue = 2**(8*self.__samplewidth-1)
-        if self.nchannels == 1:
+        if numpy and self.__samplewidth in samplewidths_to_numpy_dtype and self.__frames:
+            left, right = _levels_from_buffer(self.__frames, self.__samplewidth, self.__nchannels, rms_mode)
+            peak_left = (left+1)/maxvalue
+            peak_right = (right+1)/maxvalue
+        elif self.nchannels == 1:
             if rms_mode:
                 peak_left = peak_right = (audioop.rms(self.__frames, self.__samplewidth)+1)/maxvalue
             else:
                 peak_left = peak_right = (audioop.max(self.__frames, self.__samplewidth)+1)/maxvalue
         else:
-            left_frames = audioop.tomono(self.__frames, self.__samplewidth, 1, 0)
-            right_frames = audioop.tomono(self.__frames, self.__samplewidth, 0, 1)
+            left_frames, right_frames = self._split_channels()
             if rms_mode:
                 peak_left = (audioop.rms(left_frames, self.__samplewidth)+1)/maxvalue
                 peak_right = (audioop.rms(right_frames, self.__samplewidth)+1)/maxvalue
@@ -193,7 +437,19 @@ class Sample:
 
     def get_frame_array(self):
         """Returns the sample values as array. Warning: this can copy large amounts of data."""
-        return Sample.get_array(self.samplewidth, self.__frames)
+        frames = Sample.get_array(self.samplewidth)
+        frames.frombytes(self.__frames)
+        return frames
+
+    def _frames_view(self, as_frames=False):
+        """
+        Returns the sample values as a read-only numpy array directly on top of the frame data (no copy).
+        With as_frames, the array has a row per frame and a column per channel.
+        Requires numpy and a sample width of 2 or 4 bytes.
+        """
+        samples = numpy.frombuffer(self.__frames, dtype=samplewidths_to_numpy_dtype[self.__samplewidth])
+        samples.flags.writeable = False   # also for writable frame buffers such as a bytearray
+        return samples.reshape(-1, self.__nchannels) if as_frames else samples
 
     @staticmethod
     def get_array(samplewidth, initializer=None):
@@ -210,10 +466,13 @@ class Sample:
         """Overwrite the current sample with a copy of the other."""
         assert not self.__locked
         self.__frames = other.__frames
+        other.__frames_owned = False   # the frames are shared now
         self.__samplewidth = other.__samplewidth
         self.__samplerate = other.__samplerate
         self.__nchannels = other.__nchannels
         self.__filename = other.__filename
+        self.__cached_max = other.__cached_max
+        self.__cached_rms = other.__cached_rms
         return self
 
     def lock(self):
@@ -223,11 +482,17 @@ class Sample:
 
     def frame_idx(self, seconds):
         """Calculate the raw frame index for the sample at the given timestamp."""
-        return self.nchannels*self.samplewidth*int(self.samplerate*seconds)
+        return self.__nchannels*self.__samplewidth*int(self.__samplerate*seconds)
 
     def load_wav(self, file_or_stream):
-        """Loads sample data from the wav file. You can use a filename or a stream object."""
+        """
+        Loads sample data from the wav file. You can use a filename or a stream object.
+        A file given by name is memory mapped to find and copy the sample data in a single slice.
+        The sample doesn't keep using the mapping, so the file can be overwritten or deleted afterwards.
+        """
         assert not self.__locked
+        if isinstance(file_or_stream, str) and self._load_wav_mmap(file_or_stream):
+            return self
         with wave.open(file_or_stream) as w:
             if not 2 <= w.getsampwidth() <= 4:
                 raise IOError("only supports sample sizes of 2, 3 or 4 bytes")
@@ -239,6 +504,46 @@ class Sample:
             self.__samplewidth = w.getsampwidth()
             return self
 
+    def _load_wav_mmap(self, filename):
+        """
+        Memory maps a plain PCM wav file, finds the sample data in it and copies it out.
+        The data is deliberately not used directly from the mapping: writing to the file
+        (for instance saving the sample to the same file) would make the mapping invalid,
+        and an open mapping prevents the file from being replaced or deleted on Windows.
+        Returns False if the file can't be handled this way (the wave module is used instead).
+        """
+        with open(filename, "rb") as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                return False
+        with mapped:
+            if mapped[:4] != b"RIFF" or mapped[8:12] != b"WAVE":
+                return False
+            fmt = None
+            position = 12
+            while position + wav_chunk_header.size <= len(mapped):
+                chunk_id, chunk_size = wav_chunk_header.unpack_from(mapped, position)
+                position += wav_chunk_header.size
+                if chunk_id == b"fmt " and chunk_size >= wav_format_chunk.size:
+                    fmt = wav_format_chunk.unpack_from(mapped, position)
+                elif chunk_id == b"data" and fmt and fmt[0] == 1:   # 1 = WAVE_FORMAT_PCM
+                    _, nchannels, samplerate, _, _, bits = fmt
+                    samplewidth = (bits + 7) // 8
+                    if not 2 <= samplewidth <= 4:
+                        raise IOError("only supports sample sizes of 2, 3 or 4 bytes")
+                    if not 1 <= nchannels <= 2:
+                        raise IOError("only supports mono or stereo channels")
+                    framesize = nchannels * samplewidth
+                    numframes = min(chunk_size, len(mapped) - position) // framesize
+                    self.__frames = mapped[position:position + numframes * framesize]   # a bytes copy
+                    self.__nchannels = nchannels
+                    self.__samplerate = samplerate
+                    self.__samplewidth = samplewidth
+                    return True
+                position += chunk_size + (chunk_size & 1)
+            return False
+
     def write_wav(self, file_or_stream):
         """Write a wav file with the current sample data. You can use a filename or a stream object."""
         with wave.open(file_or_stream, "wb") as out:
@@ -249,7 +554,7 @@ class Sample:
     def wave_write_begin(cls, filename, first_sample):
         """
         Part of the sample stream output api: begin writing a sample to an output file.
-        Returns the open file for future writing.
+        You can use a filename or a stream object. Returns the open file for future writing.
         """
         out = wave.open(filename, "wb")
         out.setparams((first_sample.nchannels, first_sample.samplewidth, first_sample.samplerate, 0, "NONE", "not compressed"))
@@ -269,7 +574,18 @@ class Sample:
 
     def write_frames(self, stream):
         """Write the raw sample data to the output stream."""
-        stream.write(self.__frames)
+        stream.write(self.raw_frames_for_output())
+
+    def raw_frames_for_output(self):
+        """
+        Returns the raw sample data as a read-only buffer that can be written directly to an audio output stream.
+        It doesn't change when the sample is modified afterwards, so it can be queued for output.
+        """
+        frames = self.__frames
+        # pyaudio only accepts read-only buffers, so mutable ones have to be turned into bytes first
+        if isinstance(frames, bytearray) or (isinstance(frames, memoryview) and not frames.readonly):
+            return bytes(frames)
+        return frames
 
     def normalize(self):
         """
@@ -277,6 +593,10 @@ class Sample:
         When mixing samples, they should all have the same properties, and this method is ideal to make sure of that.
         """
         assert not self.__locked
+        if numpy and self.__samplewidth in samplewidths_to_numpy_dtype \
+                and self.norm_samplewidth in samplewidths_to_numpy_dtype:
+            if soxr or self.__samplerate == self.norm_samplerate:
+                return self._normalize_numpy()
         self.resample(self.norm_samplerate)
         if self.samplewidth != self.norm_samplewidth:
             # Convert to 16 bit sample size.
@@ -288,15 +608,38 @@ class Sample:
             self.__nchannels = 2
         return self
 
+    def _normalize_numpy(self):
+        # the same conversions as normalize, but fused into a single pass over the sample data
+        if self.__samplerate == self.norm_samplerate and self.__samplewidth == self.norm_samplewidth \
+                and self.__nchannels != 1:
+            return self
+        samples = self._frames_view(as_frames=True)
+        if self.__samplerate != self.norm_samplerate:
+            samples = soxr.resample(samples, self.__samplerate, self.norm_samplerate, quality="HQ")
+        dtype = samplewidths_to_numpy_dtype[self.norm_samplewidth]
+        shift = 8*(self.__samplewidth-self.norm_samplewidth)   # scale the values like audioop.lin2lin does
+        if shift > 0:
+            samples = (samples >> shift).astype(dtype)
+        elif shift < 0:
+            samples = samples.astype(dtype) << -shift
+        if self.__nchannels == 1:
+            samples = numpy.repeat(samples, 2, axis=1)
+        self.__frames = samples.tobytes()
+        self.__samplerate = self.norm_samplerate
+        self.__samplewidth = self.norm_samplewidth
+        self.__nchannels = max(self.__nchannels, 2)
+        return self
+
     def resample(self, samplerate):
         """
         Resamples to a different sample rate, without changing the pitch and duration of the sound.
-        The algorithm used is simple, and it will cause a loss of sound quality.
+        If the soxr module is available it is used for high quality resampling. Otherwise
+        the algorithm used is simple, and it will cause a loss of sound quality.
         """
         assert not self.__locked
         if samplerate == self.__samplerate:
             return self
-        self.__frames = audioop.ratecv(self.__frames, self.samplewidth, self.nchannels, self.samplerate, samplerate, None)[0]
+        self.__frames = self._resample_frames(self.samplerate, samplerate)
         self.__samplerate = samplerate
         return self
 
@@ -304,17 +647,25 @@ class Sample:
         """
         Changes the playback speed of the sample, without changing the sample rate.
         This will change the pitch and duration of the sound accordingly.
-        The algorithm used is simple, and it will cause a loss of sound quality.
+        If the soxr module is available it is used for high quality resampling. Otherwise
+        the algorithm used is simple, and it will cause a loss of sound quality.
         """
         assert not self.__locked
         assert speed > 0
         if speed == 1.0:
             return self
         rate = self.samplerate
-        self.__frames = audioop.ratecv(self.__frames, self.samplewidth, self.nchannels, int(self.samplerate*speed), rate, None)[0]
+        self.__frames = self._resample_frames(int(self.samplerate*speed), rate)
         self.__samplerate = rate
         return self
 
+    def _resample_frames(self, from_rate, to_rate):
+        """Returns the frames converted from one sample rate to another."""
+        if soxr and self.__samplewidth in samplewidths_to_numpy_dtype:
+            samples = self._frames_view(as_frames=True)
+            return soxr.resample(samples, from_rate, to_rate, quality="HQ").tobytes()
+        return audioop.ratecv(self.__frames, self.samplewidth, self.nchannels, from_rate, to_rate, None)[0]
+
     def make_32bit(self, scale_amplitude=True):
         """
         Convert to 32 bit integer sample width, usually also scaling the amplitude to fit in the new 32 bits range.
@@ -330,7 +681,12 @@ class Sample:
     def get_32bit_frames(self, scale_amplitude=True):
         """Returns the raw sample frames scaled to 32 bits. See make_32bit method for more info."""
         if self.samplewidth == 4:
+            self.__frames_owned = False   # the frames are handed out so they can't be modified in place anymore
             return self.__frames
+        if not scale_amplitude and numpy and self.samplewidth in samplewidths_to_numpy_dtype:
+            # widen the values in a single pass, instead of scaling up and back down again
+            return self._frames_view().astype('<i4').tobytes()
+        # a scaled conversion is just a single C call
         frames = audioop.lin2lin(self.__frames, self.samplewidth, 4)
         if not scale_amplitude:
             # we need to scale back the sample amplitude to fit back into 24/16/8 bit range
@@ -356,17 +712,17 @@ class Sample:
     def amplify_max(self):
         """Amplify the sample to maximum volume without clipping or overflow happening."""
         assert not self.__locked
-        max_amp = audioop.max(self.__frames, self.samplewidth)
+        max_amp = self.maximum
         max_target = 2 ** (8 * self.samplewidth - 1) - 2
         if max_amp > 0:
             factor = max_target/max_amp
-            self.__frames = audioop.mul(self.__frames, self.samplewidth, factor)
+            self.__frames = _mul_frames[self.__samplewidth](self.__frames, self.__samplewidth, factor)
         return self
 
     def amplify(self, factor):
         """Amplifies (multiplies) the sample by the given factor. May cause clipping/overflow if factor is too large."""
         assert not self.__locked
-        self.__frames = audioop.mul(self.__frames, self.samplewidth, factor)
+        self.__frames = _mul_frames[self.__samplewidth](self.__frames, self.__samplewidth, factor)
         return self
 
     def at_volume(self, volume):
@@ -404,10 +760,13 @@ class Sample:
         """Add silence at the end (or at the start)"""
         assert not self.__locked
         required_extra = self.frame_idx(seconds)
+        # allocate the zero filled result only once, and copy the sample data into it
+        frames = bytearray(len(self.__frames) + required_extra)
         if at_start:
-            self.__frames = b"\0"*required_extra + self.__frames
+            frames[required_extra:] = self.__frames
         else:
-            self.__frames += b"\0"*required_extra
+            frames[:len(self.__frames)] = self.__frames
+        self.__frames = frames
         return self
 
     def join(self, other):
@@ -416,48 +775,53 @@ class Sample:
         assert self.samplewidth == other.samplewidth
         assert self.samplerate == other.samplerate
         assert self.nchannels == other.nchannels
-        self.__frames += other.__frames
+        self.__frames = b"".join((self.__frames, other.__frames))
         return self
 
     def fadeout(self, seconds, target_volume=0.0):
         """Fade the end of the sample out to the target volume (usually zero) in the given time."""
         assert not self.__locked
-        faded = Sample.get_array(self.__samplewidth)
         seconds = min(seconds, self.duration)
         i = self.frame_idx(self.duration-seconds)
         begin = self.__frames[:i]
         end = self.__frames[i:]  # we fade this chunk
-        numsamples = len(end)/self.__samplewidth
-        decrease = 1-target_volume
-        for i in range(int(numsamples)):
-            amplitude = 1-(i/numsamples)*decrease
-            s = audioop.getsample(end, self.__samplewidth, i)
-            faded.append(int(s*amplitude))
-        end = faded.tobytes()
-        if sys.byteorder == "big":
-            end = audioop.byteswap(end, self.__samplewidth)
-        self.__frames = begin + end
+        self.__frames = b"".join((begin, self._fade_frames(end, 1.0, target_volume)))
         return self
 
     def fadein(self, seconds, start_volume=0.0):
         """Fade the start of the sample in from the starting volume (usually zero) in the given time."""
         assert not self.__locked
-        faded = Sample.get_array(self.__samplewidth)
         seconds = min(seconds, self.duration)
         i = self.frame_idx(seconds)
         begin = self.__frames[:i]  # we fade this chunk
         end = self.__frames[i:]
-        numsamples = len(begin)/self.__samplewidth
-        increase = 1-start_volume
+        self.__frames = b"".join((self._fade_frames(begin, start_volume, 1.0), end))
+        return self
+
+    def _fade_frames(self, frames, start_amp, end_amp):
+        """Returns the frames with a linear volume ramp applied, going from start_amp up to (not including) end_amp."""
+        if numpy and self.__samplewidth in samplewidths_to_numpy_dtype:
+            # vectorized: one multiply over the whole chunk, every channel of a frame gets the same amplitude
+            dtype = samplewidths_to_numpy_dtype[self.__samplewidth]
+            samples = numpy.frombuffer(frames, dtype=dtype).reshape(-1, self.__nchannels)
+            maxvalue = 2**(8*self.__samplewidth-1)
+            if numba:
+                faded = numpy.empty_like(samples)
+                _fade_kernel(samples, float(start_amp), float(end_amp), maxvalue, faded)
+                return faded.tobytes()
+            ramp = numpy.linspace(start_amp, end_amp, len(samples), endpoint=False)[:, None]
+            return numpy.clip(samples*ramp, -maxvalue, maxvalue-1).astype(dtype).tobytes()
+        faded = Sample.get_array(self.__samplewidth)
+        numsamples = len(frames)/self.__samplewidth
+        increase = end_amp-start_amp
         for i in range(int(numsamples)):
-            amplitude = i*increase/numsamples+start_volume
-            s = audioop.getsample(begin, self.__samplewidth, i)
+            amplitude = start_amp+i*increase/numsamples
+            s = audioop.getsample(frames, self.__samplewidth, i)
             faded.append(int(s*amplitude))
-        begin = faded.tobytes()
-        if sys.byteorder == "big":
-            begin = audioop.byteswap(begin, self.__samplewidth)
-        self.__frames = begin + end
-        return self
+        frames = faded.tobytes()
+        if not native_little_endian:
+            frames = audioop.byteswap(frames, self.__samplewidth)
+        return frames
 
     def modulate_amp(self, modulator):
         """
@@ -467,6 +831,8 @@ class Sample:
         is scaled to be 1.0, effectively using it as if it was an oscillator.
         """
         assert not self.__locked
+        if numpy and self.__samplewidth in samplewidths_to_numpy_dtype:
+            return self._modulate_amp_numpy(modulator)
         frames = self.get_frame_array()
         if isinstance(modulator, (Sample, list, array.array)):
             # modulator is a waveform, turn that into an 'oscillator' ran
@@ -479,10 +845,36 @@ class Sample:
         for i in range(len(frames)):
             frames[i] = int(frames[i] * next(modulator))
         self.__frames = frames.tobytes()
-        if sys.byteorder == "big":
+        if not native_little_endian:
             self.__frames = audioop.byteswap(self.__frames, self.__samplewidth)
         return self
 
+    def _modulate_amp_numpy(self, modulator):
+        # vectorized version of modulate_amp: the modulator is turned into an array of factors first
+        dtype = samplewidths_to_numpy_dtype[self.__samplewidth]
+        samples = self._frames_view()
+        if isinstance(modulator, (Sample, list, array.array)):
+            if isinstance(modulator, Sample):
+                if modulator.__samplewidth in samplewidths_to_numpy_dtype:
+                    modulator = modulator._frames_view()
+                else:
+                    modulator = modulator.get_frame_array()
+            modulator = numpy.asarray(modulator, dtype=numpy.float64)
+            biggest = max(modulator.max(), -modulator.min())
+            if biggest == 0:
+                raise ZeroDivisionError("modulator waveform is silent, it can't be scaled to 1.0")
+            factors = numpy.resize(modulator/biggest, len(samples))   # cycles the waveform if needed
+        else:
+            factors = numpy.fromiter(modulator, dtype=numpy.float64, count=len(samples))
+        maxvalue = 2**(8*self.__samplewidth-1)
+        if numba:
+            modulated = numpy.empty_like(samples)
+            _modulate_kernel(samples, factors, maxvalue, modulated)
+            self.__frames = modulated.tobytes()
+        else:
+            self.__frames = numpy.clip(samples*factors, -maxvalue, maxvalue-1).astype(dtype).tobytes()
+        return self
+
     def reverse(self):
         """Reverse the sound."""
         assert not self.__locked
@@ -503,18 +895,21 @@ class Sample:
         assert not self.__locked
         if seconds > 0:
             if keep_length:
-                num_frames = len(self.__frames)
-                self.add_silence(seconds, at_start=True)
-                self.__frames = self.__frames[:num_frames]
+                # shift the sample data into a zero filled buffer of the same length
+                frames = bytearray(len(self.__frames))
+                required_extra = min(self.frame_idx(seconds), len(frames))
+                frames[required_extra:] = memoryview(self.__frames)[:len(frames)-required_extra]
+                self.__frames = frames
                 return self
             else:
                 return self.add_silence(seconds, at_start=True)
         elif seconds < 0:
             seconds = -seconds
             if keep_length:
-                num_frames = len(self.__frames)
-                self.add_silence(seconds)
-                self.__frames = self.__frames[len(self.__frames)-num_frames:]
+                frames = bytearray(len(self.__frames))
+                skipped = min(self.frame_idx(seconds), len(frames))
+                frames[:len(frames)-skipped] = memoryview(self.__frames)[skipped:]
+                self.__frames = frames
                 return self
             else:
                 self.__frames = self.__frames[self.frame_idx(seconds):]
@@ -523,7 +918,7 @@ class Sample:
     def bias(self, bias):
         """Add a bias constant to each sample value."""
         assert not self.__locked
-        self.__frames = audioop.bias(self.__frames, self.__samplewidth, bias)
+        self.__frames = _bias_frames[self.__samplewidth](self.__frames, self.__samplewidth, bias)
         return self
 
     def mono(self, left_factor=1.0, right_factor=1.0):
@@ -558,16 +953,43 @@ class Sample:
         """
         assert not self.__locked
         if self.__nchannels == 2:
+            if numpy and self.__samplewidth in samplewidths_to_numpy_dtype:
+                # scale both channels directly on the interleaved frames, no channel splitting needed
+                dtype = samplewidths_to_numpy_dtype[self.__samplewidth]
+                samples = self._frames_view(as_frames=True)
+                maxvalue = 2**(8*self.__samplewidth-1)
+                stereo = numpy.clip(samples*numpy.array([left_factor, right_factor]), -maxvalue, maxvalue-1)
+                self.__frames = numpy.floor(stereo).astype(dtype).tobytes()   # floor, to round like audioop does
+                return self
             # first split the left and right channels and then remix them
-            right = self.copy().right()
-            self.left().amplify(left_factor)
-            return self.stereo_mix(right, 'R', right_factor)
+            left, right = self._split_channels()
+            left = audioop.mul(left, self.__samplewidth, left_factor)
+            right = audioop.mul(right, self.__samplewidth, right_factor)
+            self.__frames = self._join_channels(left, right)
+            return self
         if self.__nchannels == 1:
             self.__frames = audioop.tostereo(self.__frames, self.__samplewidth, left_factor, right_factor)
             self.__nchannels = 2
             return self
         raise ValueError("sample must be mono or stereo already")
 
+    def _split_channels(self):
+        """
+        Returns the frames of a stereo sample as separate (non-interleaved) left and right channel frames.
+        This is for the audioop code paths; with numpy the channels are processed on the interleaved frames directly.
+        """
+        assert self.__nchannels == 2
+        left = audioop.tomono(self.__frames, self.__samplewidth, 1, 0)
+        right = audioop.tomono(self.__frames, self.__samplewidth, 0, 1)
+        return left, right
+
+    def _join_channels(self, left, right):
+        """Interleaves separate left and right channel frames into stereo frames (the reverse of _split_channels)."""
+        assert len(left) == len(right)
+        left = audioop.tostereo(left, self.__samplewidth, 1, 0)
+        right = audioop.tostereo(right, self.__samplewidth, 0, 1)
+        return audioop.add(left, right, self.__samplewidth)
+
     def stereo_mix(self, other, other_channel, other_mix_factor=1.0, mix_at=0.0, other_seconds=None):
         """
         Mixes another mono channel into the current sample as left or right channel.
@@ -585,6 +1007,8 @@ class Sample:
                 self.stereo(left_factor=0, right_factor=1)
             else:
                 self.stereo(left_factor=1, right_factor=0)
+        if numpy and self.__samplewidth in samplewidths_to_numpy_dtype:
+            return self._stereo_mix_numpy(other, other_channel, other_mix_factor, mix_at, other_seconds)
         # turn other sample into stereo and mix it efficiently
         other = other.copy()
         if other_channel == 'L':
@@ -593,6 +1017,24 @@ class Sample:
             other = other.stereo(left_factor=0, right_factor=other_mix_factor)
         return self.mix_at(mix_at, other, other_seconds)
 
+    def _stereo_mix_numpy(self, other, other_channel, other_mix_factor, mix_at, other_seconds):
+        # mixes the mono sample directly into one channel of the interleaved frames, without making it stereo first
+        maxvalue = 2**(8*self.__samplewidth-1)
+        mono = other._frames_view()
+        if other_seconds:
+            mono = mono[:int(other.__samplerate*other_seconds)]
+        start = int(self.__samplerate*mix_at)
+        end = start+len(mono)
+        samples = self._frames_view(as_frames=True)
+        stereo = numpy.zeros((max(len(samples), end), 2), dtype=samples.dtype)
+        stereo[:len(samples)] = samples
+        channel = stereo[start:end, 0 if other_channel == 'L' else 1]
+        # scale the other sample like audioop.tostereo does, then do a saturating add
+        mixed = numpy.floor(numpy.clip(mono*other_mix_factor, -maxvalue, maxvalue-1)) + channel
+        channel[:] = numpy.clip(mixed, -maxvalue, maxvalue-1)
+        self.__frames = stereo.tobytes()
+        return self
+
     def pan(self, panning=0, lfo=None):
         """
         Linear Stereo panning, -1 = full left, 1 = full right.
@@ -602,10 +1044,12 @@ class Sample:
         if not lfo:
             return self.stereo((1-panning)/2, (1+panning)/2)
         lfo = iter(lfo)
+        if numpy and self.__samplewidth in samplewidths_to_numpy_dtype:
+            return self._pan_numpy(lfo)
         if self.__nchannels == 2:
-            right = self.copy().right().get_frame_array()
-            left = self.copy().left().get_frame_array()
             stereo = self.get_frame_array()
+            left = stereo[0::2]
+            right = stereo[1::2]
             for i in range(len(right)):
                 panning = next(lfo)
                 left_s = left[i]*(1-panning)/2
@@ -623,6 +1067,22 @@ class Sample:
         self.__frames = Sample.from_array(stereo, self.__samplerate, 2).__frames
         return self
 
+    def _pan_numpy(self, lfo):
+        # vectorized version of the lfo panning: both channels are scaled by the whole lfo array at once
+        dtype = samplewidths_to_numpy_dtype[self.__samplewidth]
+        samples = self._frames_view(as_frames=True)
+        panning = numpy.fromiter(lfo, dtype=numpy.float64, count=len(samples))
+        stereo = numpy.empty((len(samples), 2), dtype=dtype)
+        if numba:
+            _pan_kernel(samples, panning, stereo)
+        else:
+            # for a mono sample the first and last column are the same, so it gets spread over both channels
+            stereo[:, 0] = samples[:, 0]*(1-panning)/2
+            stereo[:, 1] = samples[:, -1]*(1+panning)/2
+        self.__frames = stereo.tobytes()
+        self.__nchannels = 2
+        return self
+
     def echo(self, length, amount, delay, decay):
         """
         Adds the given amount of echos into the end of the sample,
@@ -631,6 +1091,8 @@ class Sample:
         If you use a very short delay the echos blend into the sound and the effect is more like a reverb.
         """
         assert not self.__locked
+        if amount > 0 and numpy and self.__samplewidth in samplewidths_to_numpy_dtype:
+            return self._echo_numpy(length, amount, delay, decay)
         if amount > 0:
             length = max(0, self.duration - length)
             echo = self.copy()
@@ -646,6 +1108,42 @@ class Sample:
                 echo_amp *= decay
         return self
 
+    def _echo_numpy(self, length, amount, delay, decay):
+        # same echos as the loop in echo, but all of them are summed into one output buffer
+        dtype = samplewidths_to_numpy_dtype[self.__samplewidth]
+        samples = self._frames_view()
+        length = max(0, self.duration - length)
+        echo = samples[self.frame_idx(length)//self.__samplewidth:]
+        offsets = []
+        amplitudes = []
+        echo_amp = decay
+        for _ in range(amount):
+            if echo_amp < 1.0/(2**(8*self.__samplewidth-1)):
+                # avoid computing echos that you can't hear
+                break
+            length += delay
+            offsets.append(self.frame_idx(length)//self.__samplewidth)
+            amplitudes.append(echo_amp)
+            echo_amp *= decay
+        if not offsets:
+            return self
+        maxvalue = 2**(8*self.__samplewidth-1)
+        # the output buffer is allocated once at its final size, and a single scratch
+        # buffer holds the current echo, so the loop itself doesn't allocate anything
+        mixed = numpy.zeros(max(len(samples), max(offsets)+len(echo)), dtype=numpy.int64)
+        mixed[:len(samples)] = samples
+        echo = echo.astype(numpy.float64)
+        for offset, amplitude in zip(offsets, amplitudes):
+            # every echo is the previous one amplified again, rounded like audioop.mul
+            numpy.multiply(echo, amplitude, out=echo)
+            numpy.clip(echo, -maxvalue, maxvalue-1, out=echo)
+            numpy.floor(echo, out=echo)
+            target = mixed[offset:offset+len(echo)]
+            numpy.add(target, echo, out=target, casting="unsafe")
+        numpy.clip(mixed, -maxvalue, maxvalue-1, out=mixed)
+        self.__frames = mixed.astype(dtype).tobytes()
+        return self
+
     def envelope(self, attack, decay, sustainlevel, release):
         """Apply an ADSR volume envelope. A,D,R are in seconds, Sustainlevel is a factor."""
         assert not self.__locked
@@ -675,17 +1173,17 @@ class Sample:
         assert self.samplewidth == other.samplewidth
         assert self.samplerate == other.samplerate
         assert self.nchannels == other.nchannels
-        frames1 = self.__frames
         if other_seconds:
             frames2 = other.__frames[:other.frame_idx(other_seconds)]
         else:
             frames2 = other.__frames
         if pad_shortest:
-            if len(frames1) < len(frames2):
-                frames1 += b"\0"*(len(frames2)-len(frames1))
-            elif len(frames2) < len(frames1):
-                frames2 += b"\0"*(len(frames1)-len(frames2))
-        self.__frames = audioop.add(frames1, frames2, self.samplewidth)
+            self._mix_grow_if_needed(0, len(frames2))
+        frames1 = self.__frames
+        if pad_shortest:
+            if len(frames2) < len(frames1):
+                frames2 = b"".join((frames2, bytes(len(frames1)-len(frames2))))
+        self.__frames = _add_frames[self.__samplewidth](frames1, frames2, self.__samplewidth)
         return self
 
     def mix_at(self, seconds, other, other_seconds=None):
@@ -704,97 +1202,202 @@ class Sample:
             other_frames = other.__frames[:other.frame_idx(other_seconds)]
         else:
             other_frames = other.__frames
-        # Mix the frames. Unfortunately audioop requires splitting and copying the sample data, which is slow.
-        pre, to_mix, post = self._mix_split_frames(len(other_frames), start_frame_idx)
-        self.__frames = None  # allow for garbage collection
-        mixed = audioop.add(to_mix, other_frames, self.samplewidth)
-        del to_mix  # more garbage collection
-        self.__frames = self._mix_join_frames(pre, mixed, post)
+            if other_frames is self.__frames and self.__frames_owned:
+                # mixing the sample into itself: our own buffer is going to be extended and modified
+                other_frames = bytes(other_frames)
+        end_frame_idx = start_frame_idx + len(other_frames)
+        self._mix_grow_if_needed(start_frame_idx, len(other_frames))
+        # Mix the other frames directly into the region of our own buffer (the memoryview slice doesn't copy);
+        # the frames before and after it are left untouched.
+        with memoryview(self._owned_frames()) as frames:
+            target = frames[start_frame_idx:end_frame_idx]
+            _add_into_frames[self.__samplewidth](target, other_frames, self.__samplewidth)
         return self
 
-    def _mix_join_frames(self, pre, mid, post):
-        # warning: slow due to copying (but only significant when not streaming)
-        return pre + mid + post
-
-    def _mix_split_frames(self, other_frames_length, start_frame_idx):
-        # warning: slow due to copying (but only significant when not streaming)
-        self._mix_grow_if_needed(start_frame_idx, other_frames_length)
-        pre = self.__frames[:start_frame_idx]
-        to_mix = self.__frames[start_frame_idx:start_frame_idx + other_frames_length]
-        post = self.__frames[start_frame_idx + other_frames_length:]
-        return pre, to_mix, post
-
     def _mix_grow_if_needed(self, start_frame_idx, other_length):
-        # warning: slow due to copying (but only significant when not streaming)
         required_length = start_frame_idx + other_length
         if required_length > len(self.__frames):
-            # we need to extend the current sample buffer to make room for the mixed sample at the end
-            self.__frames += b"\0" * (required_length - len(self.__frames))
+            # we need to extend the current sample buffer to make room for the mixed sample at the end.
+            # The owned bytearray over-allocates when it grows, so repeated growing is not a full copy every time.
+            self._owned_frames().extend(bytes(required_length - len(self.__frames)))
+
+    def _owned_frames(self):
+        """
+        Returns the frames as a bytearray that is referenced by this sample only, so it can be modified in place.
+        The first call copies the frames, after that the same buffer is returned until the frames are replaced.
+        """
+        if not self.__frames_owned:
+            self.__frames = bytearray(self.__frames)
+            self.__frames_owned = True
+        self.__cached_max = self.__cached_rms = None   # the caller is going to modify the frames
+        return self.__frames
+
+
+_pyaudio = None   # shared PyAudio instance, so PortAudio is initialized only once
+_pyaudio_outputters = weakref.WeakSet()   # the outputters that have a stream open on it
+
+
+def _get_pyaudio():
+    global _pyaudio
+    if _pyaudio is None:
+        _pyaudio = pyaudio.PyAudio()
+        atexit.register(_terminate_pyaudio)
+    return _pyaudio
+
+
+def _terminate_pyaudio():
+    # The outputter threads are daemons that may still be writing to their streams,
+    # so let them finish and close the streams before PortAudio itself is terminated.
+    for outputter in list(_pyaudio_outputters):
+        if outputter.is_alive():
+            outputter.wipe_queue()
+            outputter.stop()
+            outputter.join(timeout=2)
+            if outputter.is_alive():
+                return   # still blocked in a write, leave the cleanup to the process exit
+        outputter.close()
+    _pyaudio.terminate()
 
 
 class Output:
     """Plays samples to audio output device or streams them to a file."""
 
+    class RingBuffer:
+        """
+        Queue for a single producer and a single consumer thread, with a fixed (power of two) number of slots.
+        Only the producer moves the head, so putting items doesn't need a lock. The tail is moved by the consumer
+        and by clear(), which can be done from any thread; they share a lock that is uncontended otherwise.
+        Clearing frees the space of the cleared items immediately.
+        The events are only used to wake up a side that waits for an empty or full ring.
+        """
+        def __init__(self, size):
+            if size < 1:
+                raise ValueError("ring buffer size must be at least 1")
+            size = 1 << (size-1).bit_length()
+            self._slots = [None] * size
+            self._mask = size-1
+            self._head = self._tail = 0
+            self._lock = threading.Lock()
+            self._not_empty = threading.Event()
+            self._not_full = threading.Event()
+
+        def put(self, item):
+            while self._head - self._tail > self._mask:
+                self._not_full.clear()
+                if self._head - self._tail > self._mask:   # check again to not miss a get() in between
+                    self._not_full.wait()
+            self._slots[self._head & self._mask] = item
+            self._head += 1
+            if not self._not_empty.is_set():
+                self._not_empty.set()
+
+        def get(self):
+            while True:
+                while self._tail == self._head:
+                    self._not_empty.clear()
+                    if self._tail == self._head:   # check again to not miss a put() in between
+                        self._not_empty.wait()
+                with self._lock:
+                    if self._tail == self._head:
+                        continue   # the ring was cleared in the meantime
+                    index = self._tail & self._mask
+                    item = self._slots[index]
+                    self._slots[index] = None   # don't keep the item alive any longer than needed
+                    self._tail += 1
+                if not self._not_full.is_set():
+                    self._not_full.set()
+                return item
+
+        def clear(self):
+            with self._lock:
+                head = self._head
+                # release the slots before the tail moves past them, so the producer can't be writing into them yet
+                for position in range(self._tail, head):
+                    self._slots[position & self._mask] = None
+                self._tail = head
+            if not self._not_full.is_set():
+                self._not_full.set()
+
     class SoundOutputter(threading.Thread):
-        """Sound outputter running in its own thread. Requires PyAudio."""
+        """
+        Sound outputter running in its own thread. Requires sounddevice or PyAudio.
+        With sounddevice, the writes to the stream block inside PortAudio without holding the GIL,
+        so the other Python threads don't disturb the audio output.
+        """
         def __init__(self, samplerate, samplewidth, nchannels, queuesize=100):
             super().__init__(name="soundoutputter", daemon=True)
-            self.audio = pyaudio.PyAudio()
-            self.stream = self.audio.open(
-                format=self.pyaudio_format_from_width(samplewidth),
-                channels=nchannels, rate=samplerate, output=True)
-            self.queue = queue.Queue(maxsize=queuesize)
-
-        def pyaudio_format_from_width(self, width):
-            if width == 2:
-                return pyaudio.paInt16
-            elif width == 3:
-                return pyaudio.paInt24
-            elif width == 4:
-                return pyaudio.paInt32
+            if sounddevice:
+                self.audio = None
+                self.stream = sounddevice.RawOutputStream(
+                    samplerate=samplerate, channels=nchannels,
+                    dtype="int%d" % (8*samplewidth), latency="high")
+                self.stream.start()
             else:
-                raise ValueError("Invalid width: %d" % width)
+                try:
+                    audio_format = samplewidths_to_pyaudio_format[samplewidth]
+                except KeyError:
+                    raise ValueError("Invalid width: %d" % samplewidth) from None
+                self.audio = _get_pyaudio()
+                self.stream = self.audio.open(format=audio_format, channels=nchannels, rate=samplerate, output=True)
+                _pyaudio_outputters.add(self)
+            self.queue = Output.RingBuffer(queuesize)
+            self._stop_event = threading.Event()
 
         def run(self):
             while True:
-                sample = self.queue.get()
-                if not sample:
-                    break
-                sample.write_frames(self.stream)
+                frames = self.queue.get()
+                if frames is None:
+                    # only a wakeup from stop(); the frames that were queued before it have been played
+                    if self._stop_event.is_set():
+                        break
+                    continue
+                self.stream.write(frames)
             # time.sleep(self.stream.get_output_latency()+self.stream.get_input_latency()+0.001)
 
+        # preallocated silence to fill up the stream with; its size is a whole number of frames for every sample format
+        _silence = memoryview(bytes(3*2**16))
+
         def play_immediately(self, sample, continuous=False):
             sample.write_frames(self.stream)
             if not continuous:
-                filler = b"\0"*sample.samplewidth*sample.nchannels*self.stream.get_write_available()
-                self.stream.write(filler)
+                write_available = self.stream.write_available if sounddevice else self.stream.get_write_available()
+                filler_size = sample.samplewidth*sample.nchannels*write_available
+                while filler_size > 0:
+                    filler = self._silence[:filler_size]
+                    self.stream.write(filler)
+                    filler_size -= len(filler)
                 # time.sleep(self.stream.get_output_latency()+self.stream.get_input_latency()+0.001)
 
-        def add_to_queue(self, sample):
-            self.queue.put(sample)
+        def add_to_queue(self, frames):
+            """Queue raw frames (see Sample.raw_frames_for_output) for playback by the outputter thread."""
+            self.queue.put(frames)
 
-        _wipe_lock = threading.Lock()
         def wipe_queue(self):
-            with self._wipe_lock:
-                try:
-                    while True:
-                        self.queue.get(block=False)
-                except queue.Empty:
-                    pass
+            self.queue.clear()
+
+        def stop(self):
+            """Stop the outputter thread once it has played the samples that are already queued."""
+            self._stop_event.set()
+            self.queue.put(None)
 
         def close(self):
             if self.stream:
                 self.stream.close()
                 self.stream = None
-            if self.audio:
-                self.audio.terminate()
-                self.audio = None
+            _pyaudio_outputters.discard(self)
+            self.audio = None   # the shared PyAudio instance itself is terminated at exit
 
-    def __init__(self, samplerate=Sample.norm_samplerate, samplewidth=Sample.norm_samplewidth, nchannels=Sample.norm_nchannels, queuesize=100):
+    def __init__(self, samplerate=Sample.norm_samplerate, samplewidth=Sample.norm_samplewidth,
+                 nchannels=Sample.norm_nchannels, queuesize=100):
+        """
+        The queuesize is the number of samples that can be queued for asynchronous playback.
+        It is rounded up to a power of two, and must be at least 1 (the queue can't be unbounded).
+        """
         self.samplerate = samplerate
         self.samplewidth = samplewidth
         self.nchannels = nchannels
-        if pyaudio:
+        self._sample_format = (samplewidth, samplerate, nchannels)
+        if sounddevice or pyaudio:
             self.outputter = Output.SoundOutputter(samplerate, samplewidth, nchannels, queuesize)
             self.outputter.start()
             self.supports_streaming = True
@@ -818,57 +1421,81 @@ class Output:
 
     def close(self):
         if self.outputter:
-            self.outputter.add_to_queue(None)
+            self.outputter.stop()
 
     def play_sample(self, sample, async=False):
         """Play a single sample."""
-        assert sample.samplewidth == self.samplewidth
-        assert sample.samplerate == self.samplerate
-        assert sample.nchannels == self.nchannels
+        assert (sample.samplewidth, sample.samplerate, sample.nchannels) == self._sample_format
         if self.outputter:
             if async:
-                self.outputter.add_to_queue(sample)
+                self.outputter.add_to_queue(sample.raw_frames_for_output())
             else:
                 self.outputter.play_immediately(sample)
         else:
-            # try to fallback to winsound (only works on windows)
-            sample_file = "__temp_sample.wav"
-            sample.write_wav(sample_file)
-            winsound.PlaySound(sample_file, winsound.SND_FILENAME)
-            os.remove(sample_file)
+            # try to fallback to winsound (only works on windows); it can play the wav data from memory
+            wav_data = io.BytesIO()
+            sample.write_wav(wav_data)
+            winsound.PlaySound(wav_data.getvalue(), winsound.SND_MEMORY)
 
     def play_samples(self, samples, async=False):
         """Plays all the given samples immediately after each other, with no pauses."""
         if self.outputter:
             for s in self.normalized_samples(samples, 26000):
                 if async:
-                    self.outputter.add_to_queue(s)
+                    self.outputter.add_to_queue(s.raw_frames_for_output())
                 else:
                     self.outputter.play_immediately(s, True)
         else:
             # winsound doesn't cut it when playing many small sample files...
-            raise RuntimeError("Sorry but pyaudio is not installed. You need it to play streaming audio output.")
+            raise RuntimeError("Sorry but sounddevice or pyaudio is not installed. "
+                               "You need it to play streaming audio output.")
 
     def normalized_samples(self, samples, global_amplification=26000):
         """Generator that produces samples normalized to 16 bit using a single amplification value for all."""
+        scratch = numpy.empty(0) if numpy else None   # conversion buffer, reused for all samples
+        # amplification factor and >>16 in one multiplication; both saturate to the same 16 bit value
+        factor_16bit = global_amplification/2**16
         for sample in samples:
-            if sample.samplewidth != 2:
+            samplewidth, nchannels, samplerate = sample.samplewidth, sample.nchannels, sample.samplerate
+            if samplewidth == 2 and nchannels == 2 and samplerate == 44100:
+                yield sample   # already normalized, the common case for pre-normalized fragments
+                continue
+            if samplewidth == 4 and numpy:
+                # Amplify, convert to 16 bits and to stereo in one go, with the same results as the
+                # amplify/make_16bit/stereo steps below. Only the final frames are newly allocated.
+                samples32 = sample._frames_view()
+                numvalues = len(samples32)
+                if len(scratch) < numvalues:
+                    scratch = numpy.empty(numvalues)
+                values = scratch[:numvalues]
+                numpy.multiply(samples32, factor_16bit, out=values)
+                numpy.floor(values, out=values)
+                numpy.clip(values, -2**15, 2**15-1, out=values)
+                frames = numpy.empty((numvalues//nchannels, 2), dtype='<i2')
+                frames[:] = values.reshape(-1, nchannels)
+                sample = Sample.from_raw_frames(frames.tobytes(), 2, samplerate, 2)
+                samplewidth = nchannels = 2
+            elif samplewidth != 2:
                 # We can't use automatic global max amplitude because we're streaming
                 # the samples individually. So use a fixed amplification value instead
                 # that will be used to amplify all samples in stream by the same amount.
                 sample = sample.amplify(global_amplification).make_16bit(False)
-            if sample.nchannels == 1:
+                samplewidth = 2
+            if nchannels == 1:
                 sample.stereo()
-            assert sample.nchannels == 2
-            assert sample.samplerate == 44100
-            assert sample.samplewidth == 2
+                nchannels = 2
+            assert nchannels == 2
+            assert samplerate == 44100
+            assert samplewidth == 2
             yield sample
 
     def stream_to_file(self, filename, samples):
         """Saves the samples after each other into one single output wav file."""
         samples = self.normalized_samples(samples, 26000)
         sample = next(samples)
-        with Sample.wave_write_begin(filename, sample) as out:
+        # The sample fragments are usually small; the large file buffer collects them
+        # so that they are written to disk in big blocks instead of one write per fragment.
+        with open(filename, "wb", buffering=1024*1024) as file, Sample.wave_write_begin(file, sample) as out:
             for sample in samples:
                 Sample.wave_write_append(out, sample)
             Sample.wave_write_end(out)
@@ -915,14 +1542,15 @@ class LevelMeter:
             left, right = sample.level_db_peak
         left = max(left, self._lowest)
         right = max(right, self._lowest)
-        time = self._time + sample.duration
-        if (time-self._peak_left_hold) > 0.4:
-            self.peak_left -= sample.duration*30.0
+        duration = sample.duration
+        time = self._time + duration
+        # the peaks decay after they've been held for a while (the comparison is used as 0 or 1)
+        decay = duration*30.0
+        self.peak_left -= decay*((time-self._peak_left_hold) > 0.4)
+        self.peak_right -= decay*((time-self._peak_right_hold) > 0.4)
         if left >= self.peak_left:
             self.peak_left = left
             self._peak_left_hold = time
-        if (time-self._peak_right_hold) > 0.4:
-            self.peak_right -= sample.duration*30.0
         if right >= self.peak_right:
             self.peak_right = right
             self._peak_right_hold = time